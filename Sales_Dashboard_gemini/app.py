@@ -3,7 +3,20 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import hashlib
 import traceback
+from datetime import date, datetime
+from itertools import chain, islice
+from operator import itemgetter
+from pathlib import Path
+
+try:
+    from python_calamine import CalamineWorkbook
+except ImportError:
+    CalamineWorkbook = None
 
 # --- CONFIGURATION ---
 st.set_page_config(
@@ -13,19 +26,292 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+CACHE_DIR = Path.home() / ".cache" / "sop_dashboard"
+CACHE_VERSION = 11 # Bump whenever parse_workbook's output changes
+CACHE_PARTS = ('sop', 'details', 'inventory')
+CACHE_MAX_BYTES = 512 * 2**20 # Least recently used uploads are evicted past this
+DRILLDOWN_PAGE_SIZE = 500
+RISK_TABLE_ROWS = 500 # Worst balances shown in Tab 4; the full table is a download
+UI_COLUMNS = ('Order_ID', 'Status', 'Country', 'Pallets', 'Total_Qty', 'Days_Open', 'is_hold', 'is_payment_block')
+# S&OP columns whose header text varies between workbooks: role -> find_col tokens
+SOP_SCHEMA_TOKENS = {
+    'entry_date': ('entry date',),
+    'ready_date': ('ready', 'date'),
+    'ship_date': ('shipment', 'date'),
+    'payment': ('payment', 'status'),
+}
+
 # --- HELPER: ROBUST HEADER FINDER ---
-def find_header_idx(df_preview, keywords):
+def find_header_idx(preview_rows, keywords):
     """Scans first rows to find the header index based on keywords."""
-    for idx, row in df_preview.iterrows():
-        row_str = row.astype(str).str.lower().tolist()
-        # Check if ALL keywords are present in the row (fuzzy match)
-        if all(any(k in x for x in row_str) for k in keywords):
-            return idx
+    if not preview_rows:
+        return None
+    # Fixed width: header names are short, and one long comment cell must not size the whole array
+    cells = np.char.lower(np.array(preview_rows, dtype=object).astype('U256'))
+    # Check if ALL keywords are present in the row (fuzzy match)
+    row_hits = np.logical_and.reduce([(np.char.find(cells, k) >= 0).any(axis=1) for k in keywords])
+    match = np.flatnonzero(row_hits)
+    return int(match[0]) if match.size else None
+
+# --- HELPER: COLUMN FINDER ---
+def find_col(columns, *tokens, exclude=(), default=None):
+    """First column whose lowercased name contains ALL tokens and none of `exclude`."""
+    col_lower = pd.Index(columns).astype(str).str.lower()
+    mask = np.ones(len(col_lower), dtype=bool)
+    for t in tokens:
+        mask &= col_lower.str.contains(t, regex=False)
+    for t in exclude:
+        mask &= ~col_lower.str.contains(t, regex=False)
+    match = np.flatnonzero(mask)
+    return columns[match[0]] if match.size else default
+
+def order_columns(columns):
+    """Orders sheet (order number, product code, quantity) columns; product/quantity may be None."""
+    ord_id_col = find_col(columns, 'order', 'number', default=columns[0])
+    # Product code: look for 'Article', 'Product', 'Code' - avoid descriptions
+    prod_col = next((c for c in columns if any(x in str(c).lower() for x in ['finished product', 'article no', 'sku'])), None)
+    if not prod_col:
+        prod_col = find_col(columns, 'product', exclude=('description',))
+    qty_col = find_col(columns, 'quantity')
+    return ord_id_col, prod_col, qty_col
+
+def sop_schema(columns):
+    """Resolves every SOP_SCHEMA_TOKENS role to its column name (None when absent)."""
+    return {role: find_col(columns, *tokens) for role, tokens in SOP_SCHEMA_TOKENS.items()}
+
+def ui_columns(df_sop, schema):
+    """Columns the dashboard reads: UI_COLUMNS plus the discovered date and payment columns."""
+    keep = set(UI_COLUMNS) | {c for c in schema.values() if c}
+    return [c for c in df_sop.columns if c in keep]
+
+# --- HELPER: LABEL CLASSIFIER ---
+def contains_flag(series, token):
+    """Case-insensitive substring flag. Searches each distinct label once, then broadcasts by code."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes, uniques = series.cat.codes.to_numpy(), series.cat.categories.to_numpy(dtype=object)
+    else:
+        codes, uniques = pd.factorize(series.to_numpy(dtype=object))
+    hits = np.char.find(np.char.upper(uniques.astype(str)), token) >= 0
+    return np.append(hits, False)[codes] # code -1 (missing) -> False
+
+def to_datetime_fast(series):
+    """Arrow cast when every cell has one date/datetime type; pandas' coercing parser for anything else.
+    Calamine yields midnight cells as date, and Arrow would type a mixed column date32, dropping the times."""
+    if pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    values = series.to_numpy(dtype=object)
+    kinds = set(map(type, values[pd.notna(values)]))
+    if len(kinds) != 1 or not kinds <= {date, datetime, pd.Timestamp}:
+        return pd.to_datetime(series, errors='coerce')
+    try:
+        arr = pa.array(values, from_pandas=True)
+        if pa.types.is_date(arr.type) or pa.types.is_timestamp(arr.type):
+            return pd.Series(pc.cast(arr, pa.timestamp('ns')).to_numpy(zero_copy_only=False), index=series.index)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        pass # Mixed cells or out-of-range dates
+    return pd.to_datetime(series, errors='coerce')
+
+def normalize_ids(series):
+    """Stringifies IDs and strips the '.0' Excel leaves on whole numbers, once per distinct ID, without the regex engine."""
+    codes, uniques = pd.factorize(series.to_numpy(dtype=object), use_na_sentinel=False)
+    ids = pd.Index(uniques.astype(str))
+    ids = np.where(ids.str.endswith('.0'), ids.str[:-2], ids).astype(object)
+    return pd.Series(ids[codes], index=series.index)
+
+# --- HELPER: KEYED SUM ---
+def sum_by(keys, vals):
+    """groupby(keys)[vals].sum().reset_index() as one factorize + bincount; missing keys are dropped."""
+    codes, uniques = pd.factorize(keys.to_numpy(dtype=object), sort=True)
+    found = codes >= 0
+    sums = np.bincount(codes[found], weights=vals.to_numpy(dtype=np.float64)[found], minlength=len(uniques))
+    if pd.api.types.is_integer_dtype(vals): sums = sums.astype(vals.dtype)
+    return pd.DataFrame({keys.name: uniques, vals.name: sums})
+
+# --- HELPER: NUMERIC DOWNCAST ---
+def downcast(values):
+    """int32 when every value is whole and fits, else float32. Expects numbers without NaN."""
+    whole = ((values % 1 == 0) & (abs(values) < 2**31)).all()
+    return values.astype(np.int32) if whole else values.astype(np.float32)
+
+# --- HELPER: TOP-K ---
+def smallest_k(values, k):
+    """Positions of the k smallest values, ascending (equal values in row order): argpartition, then sort only those k."""
+    idx = np.argpartition(values, k - 1)[:k] if 0 < k < len(values) else np.arange(min(max(k, 0), len(values)))
+    return idx[np.lexsort((idx, values[idx]))]
+
+# --- HELPER: SINGLE-PASS WORKBOOK READER ---
+def read_workbook(uploaded_file):
+    """Opens the workbook once. Returns sheet names, a memoized getter for a sheet's raw rows,
+    and a one-shot row iterator that streams a sheet without holding all of its rows."""
+    uploaded_file.seek(0)
+    sheet_names, parse_sheet, stream_sheet = None, None, None
+    if CalamineWorkbook is not None:
+        try:
+            wb = CalamineWorkbook.from_filelike(uploaded_file)
+            def stream_calamine(s):
+                sheet = wb.get_sheet_by_name(s)
+                # iter_rows() drops leading empty columns; only stream when that keeps indices aligned
+                if sheet.start is None or sheet.start[1] == 0: return sheet.iter_rows()
+                return iter(sheet.to_python(skip_empty_area=False))
+            sheet_names, parse_sheet = wb.sheet_names, lambda s: wb.get_sheet_by_name(s).to_python(skip_empty_area=False)
+            stream_sheet = stream_calamine
+        except Exception:
+            uploaded_file.seek(0)
+    if parse_sheet is None:
+        # Fallback: pandas default engine (openpyxl / xlrd)
+        xls = pd.ExcelFile(uploaded_file)
+        sheet_names, parse_sheet = xls.sheet_names, lambda s: pd.read_excel(xls, sheet_name=s, header=None, dtype=object).values.tolist()
+
+    # Each sheet is parsed at most once per load, even if several lookups resolve to it
+    parsed = {}
+    def get_rows(sheet):
+        if sheet not in parsed:
+            parsed[sheet] = parse_sheet(sheet)
+        return parsed[sheet]
+    def iter_rows(sheet, reuse=False):
+        # reuse=True: another loader reads this sheet too, so parse it once into the memo instead of streaming
+        if reuse or sheet in parsed or stream_sheet is None: return iter(get_rows(sheet))
+        return stream_sheet(sheet)
+    return sheet_names, get_rows, iter_rows
+
+def frame_from_rows(rows, header_idx, usecols=None):
+    """Promotes row header_idx to column names (read_excel style) and builds the frame below it.
+    `rows` may be a one-shot iterator. `usecols(columns)` names the columns to materialize;
+    only those cells are kept from each row as it streams past."""
+    rows = iter(rows)
+    header = next(islice(rows, header_idx, None), None)
+    if header is None: raise IndexError(f"Header row {header_idx} is past the end of the sheet")
+    columns, seen = [], {}
+    for i, c in enumerate(header):
+        name = f"Unnamed: {i}" if pd.isna(c) or str(c).strip() == '' else str(c).strip()
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        columns.append(name)
+    if usecols is None:
+        df = pd.DataFrame(list(rows), columns=columns)
+    else:
+        wanted = set(usecols(columns))
+        keep = [i for i, c in enumerate(columns) if c in wanted]
+        if keep:
+            pick = itemgetter(*keep) if len(keep) > 1 else lambda r, i=keep[0]: (r[i],)
+            values = list(zip(*map(pick, rows))) or [()] * len(keep)
+            df = pd.DataFrame({columns[i]: list(col) for i, col in zip(keep, values)})
+        else:
+            df = pd.DataFrame()
+    # Calamine returns '' for blank cells
+    return df.where(df.ne(''))
+
+def read_table(rows, keywords, scan_rows, default_header, usecols=None):
+    """Detects the header in the first scan_rows rows and builds the frame from the same stream."""
+    rows = iter(rows)
+    preview = list(islice(rows, scan_rows))
+    header_idx = find_header_idx(preview, keywords)
+    if header_idx is None: header_idx = default_header # Fallback
+    return frame_from_rows(chain(preview, rows), header_idx, usecols)
+
+# --- HELPER: PARQUET CACHE ---
+def file_digest(uploaded_file):
+    """Content hash of the upload. Keys both st.cache_data and the Parquet cache."""
+    return f"v{CACHE_VERSION}_" + hashlib.blake2b(uploaded_file.getvalue(), digest_size=16).hexdigest()
+
+def arrow_safe(df):
+    """Gives raw object columns a type Parquet can store, so cached and freshly parsed frames match.
+    Pure numbers get a numeric dtype; mixed cells (e.g. 3 and 'TBC') become strings."""
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            if pd.api.types.infer_dtype(df[col].cat.categories, skipna=True) != 'string':
+                # Stringify the categories; labels that collide (5 and '5') share one category
+                norm_codes, labels = pd.factorize(df[col].cat.categories.astype(str), sort=True)
+                df[col] = pd.Categorical.from_codes(np.append(norm_codes, -1)[df[col].cat.codes.to_numpy()], labels)
+        elif df[col].dtype == object:
+            kind = pd.api.types.infer_dtype(df[col], skipna=True)
+            if kind in ('integer', 'floating', 'mixed-integer-float', 'decimal'):
+                df[col] = pd.to_numeric(df[col])
+            elif kind not in ('string', 'empty', 'boolean', 'date', 'datetime'):
+                df[col] = df[col].astype('string')
+    return df
+
+def read_parquet_cache(digest):
+    """Returns the cached (sop, details, inventory) frames, or None on a miss."""
+    paths = [CACHE_DIR / f"{digest}_{part}.parquet" for part in CACHE_PARTS]
+    if not all(p.exists() for p in paths):
+        return None
+    try:
+        frames = tuple(pq.read_table(p, memory_map=True).to_pandas(self_destruct=True) for p in paths)
+        for p in paths: p.touch() # Recency for the size-bound eviction
+        return frames
+    except Exception:
+        return None
+
+def write_parquet_cache(digest, frames):
+    """Writes the frames, then prunes the cache. Returns an error message, or None on success;
+    a failed or partial write just reads back as a miss."""
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        for part, df in zip(CACHE_PARTS, frames):
+            df.to_parquet(CACHE_DIR / f"{digest}_{part}.parquet", engine="pyarrow", compression="zstd")
+        prune_parquet_cache(digest)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
     return None
 
+def prune_parquet_cache(keep_digest):
+    """Drops entries from older CACHE_VERSIONs (they can never hit again), then the least recently
+    used uploads until the cache fits CACHE_MAX_BYTES. keep_digest is never evicted."""
+    entries = {}
+    for path in CACHE_DIR.glob("v*_*.parquet"):
+        if not path.name.startswith(f"v{CACHE_VERSION}_"):
+            path.unlink(missing_ok=True)
+            continue
+        digest, stat = path.name.rsplit('_', 1)[0], path.stat()
+        size, used = entries.get(digest, (0, 0))
+        entries[digest] = (size + stat.st_size, max(used, stat.st_mtime))
+    total = sum(size for size, _ in entries.values())
+    for digest, (size, _) in sorted(entries.items(), key=lambda e: e[1][1]):
+        if total <= CACHE_MAX_BYTES: break
+        if digest == keep_digest: continue
+        for part in CACHE_PARTS: (CACHE_DIR / f"{digest}_{part}.parquet").unlink(missing_ok=True)
+        total -= size
+
+# --- HELPER: ORDER AGING ---
+def add_days_open(df_sop, today, entry_col):
+    """Adds Days_Open (whole days since entry_col) as int32, or float32 with NaN if any date is missing."""
+    if entry_col:
+        entry_days = df_sop[entry_col].to_numpy(dtype='datetime64[D]')
+        days_open = (np.datetime64(today, 'D') - entry_days).astype(np.int64)
+        missing = np.isnat(entry_days)
+        if missing.any():
+            df_sop['Days_Open'] = np.where(missing, np.nan, days_open).astype(np.float32)
+        else:
+            df_sop['Days_Open'] = days_open.astype(np.int32)
+    return df_sop
+
 # --- CACHED DATA LOADER ---
-@st.cache_data
-def load_data(uploaded_file):
+@st.cache_data(max_entries=8) # One entry per (upload, day): keep the bound
+def load_data(_uploaded_file, digest, today):
+    """Serves parsed frames from the Parquet cache, parsing the workbook only on a miss.
+    Keyed on (digest, today): the file itself is not hashed, and Days_Open rolls over daily."""
+    cached = read_parquet_cache(digest)
+    if cached is not None:
+        df_sop, df_orders_detail, df_inventory = cached
+        logs = []
+    else:
+        df_sop, df_orders_detail, df_inventory, logs = parse_workbook(_uploaded_file)
+        if df_sop is not None:
+            df_sop, df_orders_detail, df_inventory = (arrow_safe(df) for df in (df_sop, df_orders_detail, df_inventory))
+        # Only clean loads are cached, so a hit never hides loading warnings
+        if df_sop is not None and not logs:
+            error = write_parquet_cache(digest, (df_sop, df_orders_detail, df_inventory))
+            if error: logs.append(f"Warning: Parquet cache not written ({error})")
+
+    if df_sop is not None:
+        df_sop = add_days_open(df_sop, today, sop_schema(df_sop.columns)['entry_date'])
+    return df_sop, df_orders_detail, df_inventory, logs
+
+def parse_workbook(uploaded_file):
     """
     Master ETL function. Returns:
     1. df_sop_merged: Main S&OP data merged with Order totals.
@@ -34,8 +320,7 @@ def load_data(uploaded_file):
     """
     logs = []
     try:
-        xls = pd.ExcelFile(uploaded_file)
-        sheet_names = xls.sheet_names
+        sheet_names, get_rows, iter_rows = read_workbook(uploaded_file)
         
         # ==========================================
         # 1. LOAD S&OP (MASTER DATA)
@@ -45,33 +330,39 @@ def load_data(uploaded_file):
             return None, None, None, ["Critical: S&OP sheet not found."]
 
         # Smart Header: Look for 'Status' and 'Country'
-        df_prev_sop = pd.read_excel(xls, sheet_name=sop_sheet, header=None, nrows=15)
-        sop_header = find_header_idx(df_prev_sop, ['status', 'country'])
-        if sop_header is None: sop_header = 1 # Fallback
-        
-        df_sop = pd.read_excel(xls, sheet_name=sop_sheet, header=sop_header)
-        df_sop.columns = df_sop.columns.astype(str).str.strip()
+        df_sop = read_table(get_rows(sop_sheet), ['status', 'country'], scan_rows=15, default_header=1)
         
         # Identify Order ID
-        sop_id_col = next((c for c in df_sop.columns if 'Proforma' in c), df_sop.columns[0])
+        sop_id_col = find_col(df_sop.columns, 'proforma', default=df_sop.columns[0])
         df_sop.rename(columns={sop_id_col: 'Order_ID'}, inplace=True)
 
         # Cleanup Rows
         if 'Order_ID' in df_sop.columns:
             df_sop = df_sop[~df_sop['Order_ID'].astype(str).str.lower().isin(['input', 'formula', 'nan', 'order number'])]
             df_sop = df_sop.dropna(subset=['Order_ID'])
-            df_sop['Order_ID'] = df_sop['Order_ID'].astype(str).str.replace(r'\.0$', '', regex=True)
+            df_sop['Order_ID'] = normalize_ids(df_sop['Order_ID'])
 
         # Dates
         date_cols = [col for col in df_sop.columns if 'date' in str(col).lower()]
         for col in date_cols:
-            df_sop[col] = pd.to_datetime(df_sop[col], errors='coerce')
+            df_sop[col] = to_datetime_fast(df_sop[col])
 
         # Status & Pallets Normalization
         if 'Status' not in df_sop.columns: df_sop['Status'] = 'UNKNOWN'
-        df_sop['Status'] = df_sop['Status'].fillna('Unknown').astype(str).str.upper().str.strip()
+        # Normalize each distinct label once; labels that collapse together share one category
+        codes, uniques = pd.factorize(df_sop['Status'].fillna('Unknown').astype(str))
+        norm_codes, norm_uniques = pd.factorize(uniques.str.upper().str.strip(), sort=True)
+        df_sop['Status'] = pd.Categorical.from_codes(norm_codes[codes], norm_uniques)
+        
+        # Classification flags: computed once here instead of str.contains on every rerun
+        df_sop['is_hold'] = contains_flag(df_sop['Status'], 'HOLD')
+        payment_col = find_col(df_sop.columns, *SOP_SCHEMA_TOKENS['payment'])
+        if payment_col:
+            df_sop['is_payment_block'] = contains_flag(df_sop[payment_col], 'PAYMENT')
+        else:
+            df_sop['is_payment_block'] = False
         
-        pallet_col = next((c for c in df_sop.columns if 'pallet' in str(c).lower()), None)
+        pallet_col = find_col(df_sop.columns, 'pallet')
         df_sop['Pallets'] = pd.to_numeric(df_sop[pallet_col], errors='coerce').fillna(0) if pallet_col else 0
 
         # ==========================================
@@ -81,45 +372,33 @@ def load_data(uploaded_file):
         df_orders_detail = pd.DataFrame()
         
         if orders_sheet:
-            # Smart Header: Look for 'Order' and 'Number'
-            df_prev_ord = pd.read_excel(xls, sheet_name=orders_sheet, header=None, nrows=30)
-            ord_header = find_header_idx(df_prev_ord, ['order', 'number'])
-            if ord_header is None: ord_header = 20 # Fallback
-            
-            df_orders_detail = pd.read_excel(xls, sheet_name=orders_sheet, header=ord_header)
-            df_orders_detail.columns = df_orders_detail.columns.astype(str).str.strip()
+            # Smart Header: Look for 'Order' and 'Number'. Only the columns used below are materialized
+            df_orders_detail = read_table(iter_rows(orders_sheet), ['order', 'number'], scan_rows=30, default_header=20, usecols=order_columns)
+            ord_id_col, prod_col, qty_col = order_columns(df_orders_detail.columns)
             
             # Identify Order ID
-            ord_id_col = next((c for c in df_orders_detail.columns if 'order' in str(c).lower() and 'number' in str(c).lower()), df_orders_detail.columns[0])
             df_orders_detail.rename(columns={ord_id_col: 'Order_ID'}, inplace=True)
-            df_orders_detail['Order_ID'] = df_orders_detail['Order_ID'].astype(str).str.replace(r'\.0$', '', regex=True)
+            df_orders_detail['Order_ID'] = normalize_ids(df_orders_detail['Order_ID'])
             
             # Identify Product Code (Crucial for Inventory)
-            # Look for 'Article', 'Product', 'Code' - avoid descriptions
-            prod_col = next((c for c in df_orders_detail.columns if any(x in str(c).lower() for x in ['finished product', 'article no', 'sku'])), None)
-            # Fallback: look for generic 'Product' but try to avoid descriptions
-            if not prod_col:
-                 prod_col = next((c for c in df_orders_detail.columns if 'product' in str(c).lower() and 'description' not in str(c).lower()), None)
-            
             if prod_col:
                 df_orders_detail.rename(columns={prod_col: 'Product_Code'}, inplace=True)
             else:
                 df_orders_detail['Product_Code'] = 'Unknown_Product'
 
             # Identify Quantity
-            qty_col = next((c for c in df_orders_detail.columns if 'quantity' in str(c).lower()), None)
             if qty_col:
                 df_orders_detail['Quantity'] = pd.to_numeric(df_orders_detail[qty_col], errors='coerce').fillna(0)
             else:
                 df_orders_detail['Quantity'] = 0
+            df_orders_detail['Quantity'] = downcast(df_orders_detail['Quantity'])
 
-            # --- MERGE QTY TO S&OP ---
-            df_agg = df_orders_detail.groupby('Order_ID')['Quantity'].sum().reset_index()
-            df_agg.rename(columns={'Quantity': 'Total_Qty'}, inplace=True)
-            
-            if 'Total_Qty' in df_sop.columns: df_sop.drop(columns=['Total_Qty'], inplace=True)
-            df_sop = pd.merge(df_sop, df_agg, on='Order_ID', how='left')
-            df_sop['Total_Qty'] = df_sop['Total_Qty'].fillna(0)
+            # --- JOIN QTY TO S&OP ---
+            # One hash pass maps both ID columns to shared int64 codes; the join is then an integer scatter-add
+            ord_ids = df_orders_detail['Order_ID'].to_numpy(dtype=object)
+            codes, uniques = pd.factorize(np.concatenate([ord_ids, df_sop['Order_ID'].to_numpy(dtype=object)]))
+            qty_by_code = np.bincount(codes[:len(ord_ids)], weights=df_orders_detail['Quantity'].to_numpy(dtype=np.float64), minlength=len(uniques))
+            df_sop['Total_Qty'] = qty_by_code[codes[len(ord_ids):]]
 
         else:
             df_sop['Total_Qty'] = 0
@@ -127,60 +406,173 @@ def load_data(uploaded_file):
         # ==========================================
         # 3. LOAD INVENTORY (STOCKLISTS)
         # ==========================================
-        df_stock_total = pd.DataFrame(columns=['Product_Code', 'Stock_Qty', 'Location'])
+        stock_frames = [] # Concatenated once below; no empty seed frame to upcast dtypes
         
-        # --- NL Stock ---
         sheet_nl = next((s for s in sheet_names if 'stocklist' in s.lower() and 'nl' in s.lower()), None)
+        sheet_ee = next((s for s in sheet_names if 'stocklist' in s.lower() and 'ee' in s.lower()), None)
+        shared_stock = sheet_nl is not None and sheet_nl == sheet_ee # One combined 'Stocklist NL/EE' tab
+
+        # --- NL Stock ---
         if sheet_nl:
             try:
                 # Based on snippets, header likely row 1
-                df_nl = pd.read_excel(xls, sheet_name=sheet_nl, header=1)
-                df_nl.columns = df_nl.columns.astype(str).str.strip()
-                # Find columns
-                prod_nl = next((c for c in df_nl.columns if 'prod' in c.lower() and 'code' in c.lower()), None) # 'Prod.code'
-                qty_nl = next((c for c in df_nl.columns if 'quantity' in c.lower()), None)
+                nl_columns = lambda cols: (find_col(cols, 'prod', 'code'), find_col(cols, 'quantity')) # 'Prod.code'
+                df_nl = frame_from_rows(iter_rows(sheet_nl, reuse=shared_stock), 1, usecols=nl_columns)
+                prod_nl, qty_nl = nl_columns(df_nl.columns)
                 
                 if prod_nl and qty_nl:
                     temp_nl = df_nl[[prod_nl, qty_nl]].copy()
                     temp_nl.columns = ['Product_Code', 'Stock_Qty']
+                    # Typed before the concat, so the combined frame keeps these dtypes and needs no re-cleaning
+                    temp_nl['Stock_Qty'] = pd.to_numeric(temp_nl['Stock_Qty'], errors='coerce').fillna(0)
+                    temp_nl['Product_Code'] = temp_nl['Product_Code'].astype(str).str.strip()
                     temp_nl['Location'] = 'NL'
-                    df_stock_total = pd.concat([df_stock_total, temp_nl])
+                    stock_frames.append(temp_nl)
             except:
                 logs.append("Warning: Failed to parse Stocklist NL")
 
         # --- EE Stock ---
-        sheet_ee = next((s for s in sheet_names if 'stocklist' in s.lower() and 'ee' in s.lower()), None)
         if sheet_ee:
             try:
                 # Based on snippets, header likely row 0
-                df_ee = pd.read_excel(xls, sheet_name=sheet_ee, header=0)
-                df_ee.columns = df_ee.columns.astype(str).str.strip()
-                # Find columns
-                prod_ee = next((c for c in df_ee.columns if 'article' in c.lower()), None) # 'Article No.'
-                qty_ee = next((c for c in df_ee.columns if 'quantity' in c.lower()), None)
+                ee_columns = lambda cols: (find_col(cols, 'article'), find_col(cols, 'quantity')) # 'Article No.'
+                df_ee = frame_from_rows(iter_rows(sheet_ee), 0, usecols=ee_columns)
+                prod_ee, qty_ee = ee_columns(df_ee.columns)
                 
                 if prod_ee and qty_ee:
                     temp_ee = df_ee[[prod_ee, qty_ee]].copy()
                     temp_ee.columns = ['Product_Code', 'Stock_Qty']
+                    temp_ee['Stock_Qty'] = pd.to_numeric(temp_ee['Stock_Qty'], errors='coerce').fillna(0)
+                    temp_ee['Product_Code'] = temp_ee['Product_Code'].astype(str).str.strip()
                     temp_ee['Location'] = 'EE'
-                    df_stock_total = pd.concat([df_stock_total, temp_ee])
+                    stock_frames.append(temp_ee)
             except:
                 logs.append("Warning: Failed to parse Stocklist EE")
 
-        # Clean Stock Data
-        if not df_stock_total.empty:
-            df_stock_total['Stock_Qty'] = pd.to_numeric(df_stock_total['Stock_Qty'], errors='coerce').fillna(0)
-            df_stock_total['Product_Code'] = df_stock_total['Product_Code'].astype(str).str.strip()
+        # Combine Stock Data
+        if stock_frames:
+            df_stock_total = pd.concat(stock_frames, ignore_index=True, copy=False)
             # Aggregate by Product
-            df_inventory = df_stock_total.groupby('Product_Code')['Stock_Qty'].sum().reset_index()
+            df_inventory = sum_by(df_stock_total['Product_Code'], df_stock_total['Stock_Qty'])
+            df_inventory['Stock_Qty'] = downcast(df_inventory['Stock_Qty'])
         else:
             df_inventory = pd.DataFrame(columns=['Product_Code', 'Stock_Qty'])
 
+        # Low-cardinality labels as category: filters/groupbys compare int codes, not strings
+        if 'Country' in df_sop.columns: df_sop['Country'] = df_sop['Country'].astype('category')
+        if payment_col: df_sop[payment_col] = df_sop[payment_col].astype('category')
+        if 'Product_Code' in df_orders_detail.columns:
+            df_orders_detail['Product_Code'] = df_orders_detail['Product_Code'].astype('category')
+
+        # Narrow measures: int32 for whole numbers that fit, else float32
+        for col in ('Pallets', 'Total_Qty'):
+            df_sop[col] = downcast(pd.to_numeric(df_sop[col], errors='coerce').fillna(0))
+
         return df_sop, df_orders_detail, df_inventory, logs
         
     except Exception as e:
         return None, None, None, [f"Fatal Error: {str(e)}", traceback.format_exc()]
 
+# --- CACHED FILTERS & KPIs ---
+# Frames are passed as `_` args (not hashed); `df_key` = (file digest, today) identifies them.
+def filter_mask(df_sop, date_col, date_range, status='All', country='All'):
+    """Boolean row mask for the sidebar filters, built on numpy arrays. date_col is the resolved entry date column."""
+    mask = np.ones(len(df_sop), dtype=bool)
+    if date_range:
+        dates = df_sop[date_col].to_numpy()
+        mask &= (dates >= np.datetime64(date_range[0])) & (dates <= np.datetime64(date_range[1]))
+    if status != 'All':
+        mask &= (df_sop['Status'] == status).to_numpy()
+    if country != 'All':
+        mask &= (df_sop['Country'] == country).to_numpy()
+    return mask
+
+def present_labels(series, mask):
+    """Categories occurring in the masked rows. Categories are sorted at load, so no unique() + sort here."""
+    codes = series.cat.codes.to_numpy()[mask]
+    counts = np.bincount(codes[codes >= 0], minlength=len(series.cat.categories))
+    return series.cat.categories[counts > 0].tolist()
+
+@st.cache_data(max_entries=8)
+def date_bounds(_df_sop, df_key, date_col):
+    """(min, max) of the entry date column; fixed for a given upload."""
+    return _df_sop[date_col].min(), _df_sop[date_col].max()
+
+@st.cache_data(max_entries=64)
+def status_options(_df_sop, df_key, date_col, date_range):
+    """Status choices left after the date filter."""
+    return ['All'] + present_labels(_df_sop['Status'], filter_mask(_df_sop, date_col, date_range))
+
+@st.cache_data(max_entries=64)
+def country_options(_df_sop, df_key, date_col, date_range, status):
+    """Country choices left after the date and status filters."""
+    countries = present_labels(_df_sop['Country'], filter_mask(_df_sop, date_col, date_range, status))
+    return ['All'] + sorted(str(c) for c in countries)
+
+@st.cache_data(max_entries=64)
+def compute_kpis(_df_filtered, filter_key):
+    """Headline counts and pallet sums for one filter tuple."""
+    pallets = _df_filtered['Pallets'].to_numpy()
+    hold = _df_filtered['is_hold'].to_numpy()
+    blocked = _df_filtered['is_payment_block'].to_numpy()
+    return {
+        'total_orders': len(pallets),
+        'total_pallets': pallets.sum(),
+        'hold_orders': int(hold.sum()),
+        'hold_pallets': pallets[hold].sum(),
+        'blocked_orders': int(blocked.sum()),
+        'blocked_pallets': pallets[blocked].sum(),
+    }
+
+@st.cache_data(max_entries=64)
+def compute_breakdowns(_df_filtered, filter_key):
+    """Orders per status and pallets per country: one bincount over category codes each."""
+    status = _df_filtered['Status']
+    n_status = np.bincount(status.cat.codes.to_numpy(), minlength=len(status.cat.categories))
+    order = np.argsort(-n_status, kind='stable')
+    order = order[n_status[order] > 0] # Drop categories filtered out
+    status_counts = pd.DataFrame({'Status': status.cat.categories[order], 'Count': n_status[order]})
+
+    country_pallets = None
+    if 'Country' in _df_filtered.columns:
+        country = _df_filtered['Country']
+        codes = country.cat.codes.to_numpy()
+        known = codes >= 0
+        n_cats = len(country.cat.categories)
+        present = np.bincount(codes[known], minlength=n_cats) > 0
+        pallets = np.bincount(codes[known], weights=_df_filtered['Pallets'].to_numpy()[known], minlength=n_cats)
+        country_pallets = pd.DataFrame({'Country': country.cat.categories[present], 'Pallets': pallets[present]})
+    return status_counts, country_pallets
+
+def count_labels(series, fill='Unknown'):
+    """(labels, counts) of a categorical, most frequent first: one bincount over the codes, missing (-1) counted as fill."""
+    codes = series.cat.codes.to_numpy()
+    labels = np.append(series.cat.categories.to_numpy(dtype=object), fill)
+    counts = np.bincount(np.where(codes < 0, len(labels) - 1, codes), minlength=len(labels))
+    if (labels[:-1] == fill).any(): # fill is already a category: fold missing into it
+        counts[:-1][labels[:-1] == fill] += counts[-1]
+        counts[-1] = 0
+    labels, counts = labels[counts > 0], counts[counts > 0]
+    order = np.argsort(-counts, kind='stable')
+    return labels[order], counts[order]
+
+@st.cache_data(max_entries=8)
+def demand_vs_supply(_df_details, _df_inv, df_key):
+    """Per-product demand, stock and balance (outer join on Product_Code), plus the count of products ordered.
+    One factorize maps both code columns to shared ints; the join is then two scatter-adds and a subtract."""
+    demand_codes = _df_details['Product_Code'].to_numpy(dtype=object)
+    codes, products = pd.factorize(np.concatenate([demand_codes, _df_inv['Product_Code'].to_numpy(dtype=object)]), sort=True)
+    d_codes, s_codes = codes[:len(demand_codes)], codes[len(demand_codes):]
+    d_found, s_found = d_codes >= 0, s_codes >= 0 # Missing product codes drop out, as in groupby
+    demand = np.bincount(d_codes[d_found], weights=_df_details['Quantity'].to_numpy(dtype=np.float64)[d_found], minlength=len(products))
+    stock = np.bincount(s_codes[s_found], weights=_df_inv['Stock_Qty'].to_numpy(dtype=np.float64)[s_found], minlength=len(products))
+    n_ordered = int(np.count_nonzero(np.bincount(d_codes[d_found], minlength=len(products))))
+    demand, stock = downcast(demand), downcast(stock)
+    balance = downcast(stock.astype(np.float64) - demand)
+    status = pd.Categorical.from_codes((balance < 0).astype(np.int8), categories=['✅ OK', '❌ Shortage'])
+    df_risk = pd.DataFrame({'Product_Code': products, 'Demand_Qty': demand, 'Stock_Qty': stock, 'Balance': balance, 'Status': status})
+    return df_risk, n_ordered
+
 # --- UI LAYOUT ---
 def main():
     st.sidebar.title("🎛️ Controls")
@@ -194,7 +586,12 @@ def main():
 
     # Load Data
     with st.spinner('Processing S&OP + Inventory Layers...'):
-        df_sop, df_details, df_inv, logs = load_data(uploaded_file)
+        # Hash the upload once per file, not on every rerun
+        if st.session_state.get('file_id') != uploaded_file.file_id:
+            st.session_state['file_id'] = uploaded_file.file_id
+            st.session_state['df_hash'] = file_digest(uploaded_file)
+        df_key = (st.session_state['df_hash'], date.today())
+        df_sop, df_details, df_inv, logs = load_data(uploaded_file, *df_key)
     
     # Error Handling
     if df_sop is None:
@@ -206,43 +603,45 @@ def main():
         with st.expander("⚠️ Loading Warnings (Non-Critical)"):
             for log in logs: st.write(log)
 
+    # Header lookups resolved once per rerun and shared by the sidebar and every tab
+    schema = sop_schema(df_sop.columns)
+    df_full = df_sop # All columns, for the drill-down's "Show all columns"
+    # Lean working frame: filters, KPIs and charts only touch these columns
+    df_sop = df_sop[ui_columns(df_sop, schema)]
+
     # --- SIDEBAR FILTERS ---
     st.sidebar.divider()
     
     # Date Filter
-    date_col = next((c for c in df_sop.columns if 'entry date' in str(c).lower()), None)
+    date_range = None
+    date_col = schema['entry_date']
     if date_col:
-        min_date = df_sop[date_col].min()
-        max_date = df_sop[date_col].max()
+        min_date, max_date = date_bounds(df_sop, df_key, date_col)
         if pd.notnull(min_date) and pd.notnull(max_date):
             start_date, end_date = st.sidebar.date_input("Date Range", [min_date, max_date])
-            df_sop = df_sop[(df_sop[date_col] >= pd.to_datetime(start_date)) & (df_sop[date_col] <= pd.to_datetime(end_date))]
+            date_range = (start_date, end_date)
 
     # Status Filter
-    statuses = ['All'] + sorted(df_sop['Status'].unique().tolist())
-    selected_status = st.sidebar.selectbox("Order Status", statuses)
-    if selected_status != 'All':
-        df_sop = df_sop[df_sop['Status'] == selected_status]
+    selected_status = st.sidebar.selectbox("Order Status", status_options(df_sop, df_key, date_col, date_range))
 
     # Country Filter
+    selected_country = 'All'
     if 'Country' in df_sop.columns:
-        countries = ['All'] + sorted(df_sop['Country'].astype(str).unique().tolist())
+        countries = country_options(df_sop, df_key, date_col, date_range, selected_status)
         selected_country = st.sidebar.selectbox("Market / Country", countries)
-        if selected_country != 'All':
-            df_sop = df_sop[df_sop['Country'] == selected_country]
 
     # --- CALCULATIONS ---
-    total_orders = len(df_sop)
-    total_pallets = df_sop['Pallets'].sum()
+    # The numpy mask is cheaper to rebuild than a cached frame copy is to unpickle;
+    # only the small KPI/breakdown results are cached per filter tuple
+    filter_key = (df_key, date_range, selected_status, selected_country)
+    df_sop = df_sop[filter_mask(df_sop, date_col, date_range, selected_status, selected_country)]
+    kpis = compute_kpis(df_sop, filter_key)
+    status_counts, country_counts = compute_breakdowns(df_sop, filter_key)
     
-    # Status Buckets
-    hold_orders = df_sop[df_sop['Status'].str.contains('HOLD', na=False)]
-    
-    # Payment Block
-    payment_col = next((c for c in df_sop.columns if 'payment' in str(c).lower() and 'status' in str(c).lower()), None)
-    blocked_payment = pd.DataFrame()
-    if payment_col:
-         blocked_payment = df_sop[df_sop[payment_col].astype(str).str.contains('PAYMENT', case=False, na=False)]
+    # Classification masks for the filtered rows, shared by the tabs below
+    hold_mask = df_sop['is_hold'].to_numpy()
+    pay_mask = df_sop['is_payment_block'].to_numpy()
+    payment_col = schema['payment']
 
     # --- MAIN DASHBOARD ---
     st.title(f"📊 S&OP Control Tower")
@@ -250,9 +649,9 @@ def main():
 
     # Top Level KPI
     kpi1, kpi2, kpi3, kpi4 = st.columns(4)
-    kpi1.metric("Pipeline Volume", f"{total_pallets:,.0f} plts", f"{total_orders} orders")
-    kpi2.metric("Orders on HOLD", f"{len(hold_orders)}", f"{hold_orders['Pallets'].sum():,.0f} plts", delta_color="inverse")
-    kpi3.metric("Finance Blocks", f"{len(blocked_payment)}", "Action Required", delta_color="inverse")
+    kpi1.metric("Pipeline Volume", f"{kpis['total_pallets']:,.0f} plts", f"{kpis['total_orders']} orders")
+    kpi2.metric("Orders on HOLD", f"{kpis['hold_orders']}", f"{kpis['hold_pallets']:,.0f} plts", delta_color="inverse")
+    kpi3.metric("Finance Blocks", f"{kpis['blocked_orders']}", "Action Required", delta_color="inverse")
     
     # Inventory KPI (if available)
     if not df_inv.empty and not df_details.empty:
@@ -269,26 +668,25 @@ def main():
         c1, c2 = st.columns([2, 1])
         with c1:
             st.subheader("Pipeline Flow (Status)")
-            status_counts = df_sop['Status'].value_counts().reset_index()
-            status_counts.columns = ['Status', 'Count']
-            fig_funnel = px.funnel(status_counts, x='Count', y='Status', title="Order Lifecycle")
+            fig_funnel = go.Figure(go.Funnel(x=status_counts['Count'].to_numpy(), y=status_counts['Status'].to_numpy()))
+            fig_funnel.update_layout(title="Order Lifecycle")
             st.plotly_chart(fig_funnel, use_container_width=True)
         with c2:
             st.subheader("Market Volume")
-            if 'Country' in df_sop.columns:
-                country_counts = df_sop.groupby('Country')['Pallets'].sum().reset_index()
-                fig_pie = px.pie(country_counts, values='Pallets', names='Country')
+            if country_counts is not None:
+                fig_pie = go.Figure(go.Pie(values=country_counts['Pallets'].to_numpy(), labels=country_counts['Country'].to_numpy()))
                 st.plotly_chart(fig_pie, use_container_width=True)
 
         st.subheader("⚠️ Long-Term Holds (>30 Days)")
         if date_col:
-            now = pd.Timestamp.now()
-            df_sop['Days_Open'] = (now - df_sop[date_col]).dt.days
-            aging = df_sop[(df_sop['Status'].str.contains('HOLD')) & (df_sop['Days_Open'] > 30)].sort_values('Days_Open', ascending=False)
-            if not aging.empty:
+            # One fused mask over the numpy arrays; only the 10 rows shown are ever sliced out of the frame
+            days_open = df_sop['Days_Open'].to_numpy()
+            aging_rows = np.flatnonzero(hold_mask & (days_open > 30))
+            if aging_rows.size:
+                aging_rows = aging_rows[smallest_k(-days_open[aging_rows], 10)]
                 cols = ['Order_ID', 'Country', 'Status', 'Days_Open']
                 if payment_col: cols.append(payment_col)
-                st.dataframe(aging[cols].head(10), use_container_width=True)
+                st.dataframe(df_sop.iloc[aging_rows][cols], use_container_width=True)
             else:
                 st.success("No critical aging holds.")
 
@@ -298,29 +696,50 @@ def main():
         col_pay1, col_pay2 = st.columns(2)
         with col_pay1:
             if payment_col:
-                pay_summary = df_sop[payment_col].fillna('Unknown').value_counts().reset_index()
-                pay_summary.columns = ['Payment Status', 'Count']
+                labels, counts = count_labels(df_sop[payment_col])
+                pay_summary = pd.DataFrame({'Payment Status': labels, 'Count': counts})
                 fig_pay = px.bar(pay_summary, x='Payment Status', y='Count', color='Payment Status')
                 st.plotly_chart(fig_pay, use_container_width=True)
             else:
                 st.info("Payment Status column missing.")
         with col_pay2:
-            st.metric("Locked Value (Pre-Payment)", f"{blocked_payment['Pallets'].sum():,.0f} Pallets")
-            st.dataframe(blocked_payment[['Order_ID', 'Country', payment_col] if payment_col else []], use_container_width=True)
+            st.metric("Locked Value (Pre-Payment)", f"{kpis['blocked_pallets']:,.0f} Pallets")
+            st.dataframe(df_sop.loc[pay_mask, ['Order_ID', 'Country', payment_col] if payment_col else []], use_container_width=True)
 
     # --- TAB 3: OPS ---
     with tab3:
         st.subheader("Shipment Schedule")
-        ready_col = next((c for c in df_sop.columns if 'ready' in str(c).lower() and 'date' in str(c).lower()), None)
-        ship_col = next((c for c in df_sop.columns if 'shipment' in str(c).lower() and 'date' in str(c).lower()), None)
+        ready_col, ship_col = schema['ready_date'], schema['ship_date']
         
         if ready_col and ship_col:
-            gantt_df = df_sop.dropna(subset=[ready_col, ship_col]).head(50)
-            fig_gantt = px.timeline(gantt_df, x_start=ready_col, x_end=ship_col, y='Order_ID', color='Status')
+            # Next 50 shipments: subset columns first, then heap-select instead of a full sort
+            gantt_df = df_sop[['Order_ID', ready_col, ship_col, 'Status']].dropna(subset=[ready_col, ship_col]).nsmallest(50, ship_col)
+            # Timeline as horizontal bars: base = start date, length = duration in ms (one trace per status)
+            fig_gantt = go.Figure()
+            for status, grp in gantt_df.groupby('Status', observed=True):
+                fig_gantt.add_trace(go.Bar(
+                    base=grp[ready_col],
+                    x=(grp[ship_col] - grp[ready_col]).dt.total_seconds().to_numpy() * 1000,
+                    y=grp['Order_ID'].to_numpy(),
+                    orientation='h',
+                    name=str(status),
+                ))
+            fig_gantt.update_layout(barmode='overlay', xaxis_type='date', yaxis_type='category', legend_title_text='Status')
             st.plotly_chart(fig_gantt, use_container_width=True)
         else:
             st.warning("Dates for Gantt not found.")
-        st.dataframe(df_sop, use_container_width=True)
+        # Paginated drill-down: only one page is serialized to the browser per rerun
+        show_all = st.checkbox("Show all columns")
+        page_count = max(1, -(-len(df_sop) // DRILLDOWN_PAGE_SIZE))
+        page = 1
+        if page_count > 1:
+            page = st.number_input(f"Page (of {page_count})", min_value=1, max_value=page_count, value=1)
+        page_rows = df_sop.iloc[(page - 1) * DRILLDOWN_PAGE_SIZE:page * DRILLDOWN_PAGE_SIZE]
+        st.dataframe(df_full.loc[page_rows.index] if show_all else page_rows, use_container_width=True)
+        # CSV is built only when the button is clicked, not on every rerun
+        filtered_index = df_sop.index
+        st.download_button("Download filtered orders (CSV)", data=lambda: df_full.loc[filtered_index].to_csv(index=False).encode(),
+                           file_name="sop_orders.csv", mime="text/csv")
 
     # --- TAB 4: INVENTORY (NEW) ---
     with tab4:
@@ -329,24 +748,15 @@ def main():
         if df_details.empty or df_inv.empty:
             st.warning("Insufficient data for inventory analysis. Need 'Orders' details and 'Stocklist' sheets.")
         else:
-            # 1. Calculate Demand per Product
-            # Group details by Product Code
+            # Demand per Product, outer-joined with Inventory, and the Gap: one pass over shared product codes
             if 'Product_Code' in df_details.columns:
-                df_demand = df_details.groupby('Product_Code')['Quantity'].sum().reset_index()
-                df_demand.rename(columns={'Quantity': 'Demand_Qty'}, inplace=True)
-                
-                # 2. Merge with Inventory
-                df_risk = pd.merge(df_demand, df_inv, on='Product_Code', how='outer').fillna(0)
-                
-                # 3. Calculate Gap
-                df_risk['Balance'] = df_risk['Stock_Qty'] - df_risk['Demand_Qty']
-                df_risk['Status'] = np.where(df_risk['Balance'] >= 0, '✅ OK', '❌ Shortage')
+                df_risk, n_ordered = demand_vs_supply(df_details, df_inv, df_key)
                 
                 # Metrics
-                shortage_items = df_risk[df_risk['Balance'] < 0]
+                shortage_items = df_risk[df_risk['Status'] == '❌ Shortage'] # Category compare: int codes, no Balance rescan
                 
                 c1, c2, c3 = st.columns(3)
-                c1.metric("Unique Products Ordered", len(df_demand))
+                c1.metric("Unique Products Ordered", n_ordered)
                 c2.metric("Items in Shortage", len(shortage_items), delta=-len(shortage_items))
                 c3.metric("Total Deficit (Units)", f"{abs(shortage_items['Balance'].sum()):,.0f}")
                 
@@ -356,7 +766,7 @@ def main():
                 if not shortage_items.empty:
                     st.subheader("Critical Shortages (Stock < Demand)")
                     fig_risk = px.bar(
-                        shortage_items.sort_values('Balance').head(15),
+                        shortage_items.iloc[smallest_k(shortage_items['Balance'].to_numpy(), 15)],
                         x='Balance', y='Product_Code',
                         color='Balance',
                         title="Top 15 Shortages",
@@ -366,8 +776,10 @@ def main():
                     st.plotly_chart(fig_risk, use_container_width=True)
                 
                 st.subheader("Detailed Inventory Status")
+                if len(df_risk) > RISK_TABLE_ROWS:
+                    st.caption(f"Showing the {RISK_TABLE_ROWS} lowest balances of {len(df_risk):,} products.")
                 st.dataframe(
-                    df_risk.sort_values('Balance'),
+                    df_risk.iloc[smallest_k(df_risk['Balance'].to_numpy(), RISK_TABLE_ROWS)],
                     column_config={
                         "Balance": st.column_config.ProgressColumn(
                             "Net Balance",
@@ -378,6 +790,8 @@ def main():
                     },
                     use_container_width=True
                 )
+                st.download_button("Download inventory status (CSV)", data=lambda: df_risk.sort_values('Balance').to_csv(index=False).encode(),
+                                   file_name="inventory_status.csv", mime="text/csv")
             else:
                 st.error("Could not identify 'Product Code' column in Orders sheet.")
 